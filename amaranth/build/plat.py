@@ -2,8 +2,10 @@ from collections import OrderedDict
 from collections.abc import Iterable
 from abc import ABCMeta, abstractmethod
 import os
+import functools
 import textwrap
 import re
+import string
 import jinja2
 
 from .. import __version__
@@ -19,6 +21,129 @@ from .run import *
 __all__ = ["Platform", "TemplatedPlatform"]
 
 
+_INVALID_NAME = re.compile(r"[^A-Za-z0-9_]")
+_EMPTY_QUOTED = re.compile(r'^\"\"$')
+_NAME_CHARS   = frozenset(string.ascii_letters + string.digits + "_")
+
+_TCL_ESCAPE_TABLE = str.maketrans({"{": r"\{", "}": r"\}", "\\": r"\\"})
+_TCL_QUOTE_TABLE  = str.maketrans({"$": r"\$", "[": r"\[", "\\": r"\\"})
+
+# This notice serves a dual purpose: to explain that the file is autogenerated,
+# and to incorporate the Amaranth version into generated code.
+_AUTOGENERATED = f"Automatically generated by Amaranth {__version__}. Do not edit."
+
+
+def _options(opts):
+    if isinstance(opts, str):
+        return opts
+    else:
+        return " ".join(opts)
+
+
+@jinja2.pass_context
+def _hierarchy(context, signal, separator):
+    return separator.join(context["platform"]._name_map[signal][1:])
+
+
+def _ascii_escape(name):
+    # Most names are already valid identifiers; return those without building a new string.
+    if _INVALID_NAME.search(name) is None:
+        return name
+    parts = []
+    for char in name:
+        if char in _NAME_CHARS:
+            parts.append(char)
+        else:
+            parts.append("_{:02x}_".format(ord(char)))
+    return "".join(parts)
+
+
+def _tcl_escape(value):
+    # Most strings need no escaping, and checking for that is much faster than translating them.
+    if "{" in value or "}" in value or "\\" in value:
+        value = value.translate(_TCL_ESCAPE_TABLE)
+    return "{" + value + "}"
+
+
+def _tcl_quote(value):
+    if "$" in value or "[" in value or "\\" in value:
+        value = value.translate(_TCL_QUOTE_TABLE)
+    return '"' + value + '"'
+
+
+_JINJA_ENV = jinja2.Environment(
+    # Templates are identified by their source, so the loader returns the name as the source.
+    # Loading them through `get_template()` (rather than `from_string()`) is what makes Jinja2
+    # consult the bytecode cache; compiled templates are cached by `TemplatedPlatform` itself.
+    loader=jinja2.FunctionLoader(lambda source: source), cache_size=0,
+    trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined)
+_JINJA_ENV.filters.update({
+    "options":      _options,
+    "hierarchy":    _hierarchy,
+    "ascii_escape": _ascii_escape,
+    "tcl_escape":   _tcl_escape,
+    "tcl_quote":    _tcl_quote,
+})
+
+
+class _BytecodeCache(jinja2.FileSystemBytecodeCache):
+    def __init__(self, directory=None):
+        # Jinja2 only checks the bytecode format and the Python version of a cache file, but
+        # the compiled code also depends on the Jinja2 version and on the environment options
+        # (which are a part of Amaranth).
+        super().__init__(directory, pattern="__amaranth_{}_jinja2_{}_%s.cache"
+                                            .format(__version__, jinja2.__version__))
+
+    def load_bytecode(self, bucket):
+        # A damaged cache file (e.g. one truncated by an interrupted write) is a cache miss;
+        # it is then overwritten with the freshly compiled code.
+        try:
+            super().load_bytecode(bucket)
+        except Exception:
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+def _parse_flag(var, value):
+    value = value.lower()
+    if value in ("0", "no", "n", "false", ""):
+        return False
+    if value in ("1", "yes", "y", "true"):
+        return True
+    else:
+        raise ValueError("Override '{}' must be one of "
+                         "(\"0\", \"n\", \"no\", \"false\", \"\") "
+                         "or "
+                         "(\"1\", \"y\", \"yes\", \"true\"), not {!r}"
+                         .format(var, value))
+
+
+@functools.lru_cache(maxsize=None)
+def _setup_bytecode_cache():
+    # The default cache directory is private to the current user, and is created on first use.
+    # If it cannot be used, templates are still cached for the lifetime of the process.
+    try:
+        _JINJA_ENV.bytecode_cache = _BytecodeCache()
+    except (OSError, RuntimeError): # :nocov:
+        pass
+
+
+def _load_template(source):
+    # Compiled templates are also cached on disk, so that they can be reused by later processes,
+    # unless disabled with `AMARANTH_NO_BYTECODE_CACHE`. The cache is only set up once a template
+    # is needed, since importing `amaranth.build` should not touch the filesystem.
+    no_bytecode_cache = os.environ.get("AMARANTH_NO_BYTECODE_CACHE", "")
+    if _parse_flag("NO_BYTECODE_CACHE", _EMPTY_QUOTED.sub("", no_bytecode_cache)):
+        return _JINJA_ENV.from_string(source)
+    _setup_bytecode_cache()
+    return _JINJA_ENV.get_template(source)
+
+
 class Platform(ResourceManager, metaclass=ABCMeta):
     resources      = property(abstractmethod(lambda: None))
     connectors     = property(abstractmethod(lambda: None))
@@ -294,6 +419,21 @@ class TemplatedPlatform(Platform):
         """,
     }
 
+    # Compiled templates, keyed by their source. Templates are class attributes that never change
+    # at runtime, so it is safe to share the compilation results between every platform instance.
+    _template_cache = {}
+
+    @classmethod
+    def _compile_template(cls, source, origin):
+        if source not in cls._template_cache:
+            try:
+                compiled = _load_template(textwrap.dedent(source).strip())
+            except jinja2.TemplateSyntaxError as e:
+                e.args = ("{} (at {}:{})".format(e.message, origin, e.lineno),)
+                raise
+            cls._template_cache[source] = compiled
+        return cls._template_cache[source]
+
     def iter_clock_constraints(self):
         for net_signal, port_signal, frequency in super().iter_clock_constraints():
             # Skip any clock constraints placed on signals that are never used in the design.
@@ -309,15 +449,28 @@ class TemplatedPlatform(Platform):
         # scripts, Tcl scripts, ad-hoc constraint files, and so on. It is not practical to add
         # escaping code that handles every one of their edge cases, so make sure we never hit them
         # in the first place.
-        invalid_char = re.match(r"[^A-Za-z0-9_]", name)
-        if invalid_char:
+        if name[:1] and name[0] not in _NAME_CHARS:
             raise ValueError("Design name {!r} contains invalid character {!r}; only alphanumeric "
                              "characters are valid in design names"
-                             .format(name, invalid_char.group(0)))
-
-        # This notice serves a dual purpose: to explain that the file is autogenerated,
-        # and to incorporate the Amaranth version into generated code.
-        autogenerated = "Automatically generated by Amaranth {}. Do not edit.".format(__version__)
+                             .format(name, name[0]))
+
+        # Vendor platforms choose the tools and templates depending on the toolchain each time
+        # these properties are accessed; resolve them once for the whole build.
+        required_tools    = self.required_tools
+        file_templates    = self.file_templates
+        command_templates = self.command_templates
+
+        # Compile every template before doing any work, so that a syntax error is reported before
+        # running the (potentially slow) RTLIL and Verilog conversion.
+        compiled_file_templates = [
+            (self._compile_template(filename_tpl, origin=filename_tpl),
+             self._compile_template(content_tpl, origin=content_tpl))
+            for filename_tpl, content_tpl in file_templates.items()
+        ]
+        compiled_command_templates = [
+            self._compile_template(command_tpl, origin="<command#{}>".format(index + 1))
+            for index, command_tpl in enumerate(command_templates)
+        ]
 
         rtlil_text, self._name_map = rtlil.convert_fragment(fragment, name=name)
 
@@ -331,9 +484,7 @@ class TemplatedPlatform(Platform):
                 # to use a quoted empty string, but it doesn't do what one would expect. Recognize
                 # this as a useful pattern anyway, and treat `set VAR=""` on Windows the same way
                 # `export VAR=` is treated on Linux.
-                if var_env in os.environ:
-                    var_env_value = os.environ[var_env]
-                return re.sub(r'^\"\"$', "", var_env_value)
+                return _EMPTY_QUOTED.sub("", os.environ[var_env])
             elif var in kwargs:
                 kwarg = kwargs[var]
                 if issubclass(expected_type, str) and not isinstance(kwarg, str) and isinstance(kwarg, Iterable):
@@ -344,100 +495,76 @@ class TemplatedPlatform(Platform):
             else:
                 return jinja2.Undefined(name=var)
 
+        # Templates query the same few overrides over and over (e.g. `verbose` in every build
+        # script), and neither the environment nor the kwargs change during a build.
+        @functools.lru_cache(maxsize=None)
         def get_override(var):
             value = _extract_override(var, expected_type=str)
             return value
 
+        @functools.lru_cache(maxsize=None)
         def get_override_flag(var):
             value = _extract_override(var, expected_type=bool)
             if isinstance(value, str):
-                value = value.lower()
-                if value in ("0", "no", "n", "false", ""):
-                    return False
-                if value in ("1", "yes", "y", "true"):
-                    return True
-                else:
-                    raise ValueError("Override '{}' must be one of "
-                                     "(\"0\", \"n\", \"no\", \"false\", \"\") "
-                                     "or "
-                                     "(\"1\", \"y\", \"yes\", \"true\"), not {!r}"
-                                     .format(var, value))
+                return _parse_flag(var, value)
             return value
 
         def emit_rtlil():
             return rtlil_text
 
+        # Converting RTLIL to Verilog runs Yosys; do it only once for each combination of options,
+        # even if several templates ask for the same output.
+        verilog_cache = {}
+
+        def convert_verilog(strip_internal_attrs, opts):
+            key = (strip_internal_attrs, tuple(opts))
+            if key not in verilog_cache:
+                verilog_cache[key] = verilog._convert_rtlil_text(rtlil_text,
+                    strip_internal_attrs=strip_internal_attrs, write_verilog_opts=opts)
+            return verilog_cache[key]
+
         def emit_verilog(opts=()):
-            return verilog._convert_rtlil_text(rtlil_text,
-                strip_internal_attrs=True, write_verilog_opts=opts)
+            return convert_verilog(strip_internal_attrs=True, opts=opts)
 
         def emit_debug_verilog(opts=()):
             if not get_override_flag("debug_verilog"):
                 return "/* Debug Verilog generation was disabled. */"
             else:
-                return verilog._convert_rtlil_text(rtlil_text,
-                    strip_internal_attrs=False, write_verilog_opts=opts)
-
-        def emit_commands(syntax):
-            commands = []
+                return convert_verilog(strip_internal_attrs=False, opts=opts)
 
-            for name in self.required_tools:
-                env_var = tool_env_var(name)
-                if syntax == "sh":
-                    template = ": ${{{env_var}:={name}}}"
-                elif syntax == "bat":
-                    template = \
-                        "if [%{env_var}%] equ [\"\"] set {env_var}=\n" \
-                        "if [%{env_var}%] equ [] set {env_var}={name}"
-                else:
-                    assert False
-                commands.append(template.format(env_var=env_var, name=name))
-
-            for index, command_tpl in enumerate(self.command_templates):
-                command = render(command_tpl, origin="<command#{}>".format(index + 1),
-                                 syntax=syntax)
-                command = re.sub(r"\s+", " ", command)
-                if syntax == "sh":
-                    commands.append(command)
-                elif syntax == "bat":
-                    commands.append(command + " || exit /b")
-                else:
-                    assert False
-
-            return "\n".join(commands)
+        # Every tool is mentioned in both build scripts and usually in several commands as well.
+        tool_env_var_cached = functools.lru_cache(maxsize=None)(tool_env_var)
 
-        @jinja2.pass_context
-        def invoke_tool(context, name):
-            env_var = tool_env_var(name)
-            if context.parent["syntax"] == "sh":
-                return "\"${}\"".format(env_var)
-            elif context.parent["syntax"] == "bat":
-                return "%{}%".format(env_var)
+        def emit_commands(syntax):
+            if syntax == "sh":
+                def emit_tool_default(env_var, tool_name):
+                    return f": ${{{env_var}:={tool_name}}}"
+                def invoke_tool(name):
+                    return f"\"${tool_env_var_cached(name)}\""
+                command_suffix = ""
+            elif syntax == "bat":
+                def emit_tool_default(env_var, tool_name):
+                    return f"if [%{env_var}%] equ [\"\"] set {env_var}=\n" \
+                           f"if [%{env_var}%] equ [] set {env_var}={tool_name}"
+                def invoke_tool(name):
+                    return f"%{tool_env_var_cached(name)}%"
+                command_suffix = " || exit /b"
             else:
                 assert False
 
-        def options(opts):
-            if isinstance(opts, str):
-                return opts
-            else:
-                return " ".join(opts)
+            command_context = {**context, "syntax": syntax, "invoke_tool": invoke_tool}
 
-        def hierarchy(signal, separator):
-            return separator.join(self._name_map[signal][1:])
+            commands = []
 
-        def ascii_escape(string):
-            def escape_one(match):
-                if match.group(1) is None:
-                    return match.group(2)
-                else:
-                    return "_{:02x}_".format(ord(match.group(1)[0]))
-            return "".join(escape_one(m) for m in re.finditer(r"([^A-Za-z0-9_])|(.)", string))
+            for tool_name in required_tools:
+                commands.append(emit_tool_default(tool_env_var_cached(tool_name), tool_name))
 
-        def tcl_escape(string):
-            return "{" + re.sub(r"([{}\\])", r"\\\1", string) + "}"
+            for command_tpl in compiled_command_templates:
+                command = command_tpl.render(command_context)
+                command = " ".join(command.split())
+                commands.append(command + command_suffix)
 
-        def tcl_quote(string):
-            return '"' + re.sub(r"([$[\\])", r"\\\1", string) + '"'
+            return "\n".join(commands)
 
         def verbose(arg):
             if get_override_flag("verbose"):
@@ -451,39 +578,24 @@ class TemplatedPlatform(Platform):
             else:
                 return arg
 
-        def render(source, origin, syntax=None):
-            try:
-                source   = textwrap.dedent(source).strip()
-                compiled = jinja2.Template(source,
-                    trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined)
-                compiled.environment.filters["options"] = options
-                compiled.environment.filters["hierarchy"] = hierarchy
-                compiled.environment.filters["ascii_escape"] = ascii_escape
-                compiled.environment.filters["tcl_escape"] = tcl_escape
-                compiled.environment.filters["tcl_quote"] = tcl_quote
-            except jinja2.TemplateSyntaxError as e:
-                e.args = ("{} (at {}:{})".format(e.message, origin, e.lineno),)
-                raise
-            return compiled.render({
-                "name": name,
-                "platform": self,
-                "emit_rtlil": emit_rtlil,
-                "emit_verilog": emit_verilog,
-                "emit_debug_verilog": emit_debug_verilog,
-                "emit_commands": emit_commands,
-                "syntax": syntax,
-                "invoke_tool": invoke_tool,
-                "get_override": get_override,
-                "get_override_flag": get_override_flag,
-                "verbose": verbose,
-                "quiet": quiet,
-                "autogenerated": autogenerated,
-            })
+        context = {
+            "name": name,
+            "platform": self,
+            "emit_rtlil": emit_rtlil,
+            "emit_verilog": emit_verilog,
+            "emit_debug_verilog": emit_debug_verilog,
+            "emit_commands": emit_commands,
+            "syntax": None,
+            "get_override": get_override,
+            "get_override_flag": get_override_flag,
+            "verbose": verbose,
+            "quiet": quiet,
+            "autogenerated": _AUTOGENERATED,
+        }
 
         plan = BuildPlan(script="build_{}".format(name))
-        for filename_tpl, content_tpl in self.file_templates.items():
-            plan.add_file(render(filename_tpl, origin=filename_tpl),
-                          render(content_tpl, origin=content_tpl))
+        for filename_tpl, content_tpl in compiled_file_templates:
+            plan.add_file(filename_tpl.render(context), content_tpl.render(context))
         for filename, content in self.extra_files.items():
             plan.add_file(filename, content)
         return plan
@@ -27,6 +27,10 @@ class ResourceManager:
         self._ports     = []
         self._clocks    = SignalDict()
 
+        # Input buffer of each requested pin, mapped to the port it is connected to; filled in as
+        # resources are requested, and used to back-propagate clock constraints to ports.
+        self._pin_i_to_port = SignalDict()
+
         self.add_resources(resources)
         self.add_connectors(connectors)
 
@@ -151,6 +155,11 @@ class ResourceManager:
                     self._phys_reqd[phys_name] = name
 
                 self._ports.append((resource, pin, port, attrs))
+                if hasattr(pin, "i"):
+                    if isinstance(phys, Pins):
+                        self._pin_i_to_port[pin.i] = port.io
+                    if isinstance(phys, DiffPairs):
+                        self._pin_i_to_port[pin.i] = port.p
 
                 if pin is not None and resource.clock is not None:
                     self.add_clock_constraint(pin.i, resource.clock.frequency)
@@ -241,16 +250,6 @@ class ResourceManager:
         #
         # Constraints on nets with no corresponding input pin (e.g. PLL or SERDES outputs) are not
         # affected.
-        pin_i_to_port = SignalDict()
-        for res, pin, port, attrs in self._ports:
-            if hasattr(pin, "i"):
-                if isinstance(res.ios[0], Pins):
-                    pin_i_to_port[pin.i] = port.io
-                elif isinstance(res.ios[0], DiffPairs):
-                    pin_i_to_port[pin.i] = port.p
-                else:
-                    assert False
-
         for net_signal, frequency in self._clocks.items():
-            port_signal = pin_i_to_port.get(net_signal)
+            port_signal = self._pin_i_to_port.get(net_signal)
             yield net_signal, port_signal, frequency
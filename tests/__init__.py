@@ -0,0 +1,5 @@
+import os
+
+
+# Keep the build tests from writing compiled templates into the user's cache directory.
+os.environ.setdefault("AMARANTH_NO_BYTECODE_CACHE", "1")
@@ -1,5 +1,12 @@
+import os
+import tempfile
+import jinja2
+import jinja2.bccache
+
 from amaranth import *
+from amaranth.build.dsl import *
 from amaranth.build.plat import *
+from amaranth.build import plat
 
 from .utils import *
 
@@ -62,3 +69,155 @@ class PlatformTestCase(FHDLTestCase):
                          ["baz.vhd"])
         self.assertEqual(list(self.platform.iter_files(".v", ".vhd")),
                          ["foo.v", "bar.v", "baz.vhd"])
+
+
+class MockTemplatedPlatform(TemplatedPlatform):
+    resources  = [
+        Resource("clk", 0, Pins("A1", dir="i"), Clock(1e6)),
+    ]
+    connectors = []
+
+    toolchain      = "Mock"
+    required_tools = ["mock-tool"]
+    file_templates = {
+        **TemplatedPlatform.build_script_templates,
+        "{{name}}.txt": r"""
+            {{"foo{bar}\\"|tcl_escape}}
+            {{"foo$[bar]\\"|tcl_quote}}
+            {{"foo.bar-baz"|ascii_escape}}
+            {{["-a", "-b"]|options}}
+            {% for net_signal, port_signal, frequency in platform.iter_clock_constraints() %}
+            {{net_signal|hierarchy("/")}}
+            {% endfor %}
+        """,
+    }
+    command_templates = [
+        r"""{{invoke_tool("mock-tool")}} {{name}}.txt""",
+    ]
+
+
+class TemplatedPlatformTestCase(FHDLTestCase):
+    def setUp(self):
+        self.platform = MockTemplatedPlatform()
+
+    def prepare(self, **kwargs):
+        m = Module()
+        m.submodules.sub = sub = Module()
+        net = Signal()
+        sub.d.comb += net.eq(~net)
+        self.platform.add_clock_constraint(net, 1e6)
+        return self.platform.prepare(m, name="top", **kwargs)
+
+    def test_filters(self):
+        plan = self.prepare()
+        self.assertEqual(plan.files["top.txt"].splitlines(), [
+            r"{foo\{bar\}\\}",
+            r'"foo\$\[bar]\\"',
+            r"foo_2e_bar_2d_baz",
+            r"-a -b",
+            r"sub/net",
+        ])
+
+    def test_build_scripts(self):
+        plan = self.prepare()
+        self.assertEqual(plan.files["build_top.sh"].splitlines()[-2:], [
+            r': ${MOCK_TOOL:=mock-tool}',
+            r'"$MOCK_TOOL" top.txt',
+        ])
+        self.assertEqual(plan.files["build_top.bat"].splitlines()[-3:], [
+            r'if [%MOCK_TOOL%] equ [""] set MOCK_TOOL=',
+            r'if [%MOCK_TOOL%] equ [] set MOCK_TOOL=mock-tool',
+            r'%MOCK_TOOL% top.txt || exit /b',
+        ])
+
+    def test_template_syntax_error(self):
+        self.platform.file_templates = {"{{name}}.txt": "{% if %}"}
+        with self.assertRaisesRegex(jinja2.TemplateSyntaxError,
+                r"^Expected an expression, got 'end of statement block' \(at {% if %}:1\)$"):
+            self.prepare()
+
+    def test_wrong_name(self):
+        with self.assertRaisesRegex(ValueError,
+                r"^Design name '-top' contains invalid character '-'; only alphanumeric "
+                r"characters are valid in design names$"):
+            self.platform.prepare(Module(), name="-top")
+
+    def test_name_first_char(self):
+        # Only the first character of the design name is checked.
+        plan = self.platform.prepare(Module(), name="top-1")
+        self.assertIn("top-1.txt", plan.files)
+
+
+class TemplateBytecodeCacheTestCase(FHDLTestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = plat._BytecodeCache(self.cache_dir.name)
+        self.orig_bytecode_cache = plat._JINJA_ENV.bytecode_cache
+        plat._JINJA_ENV.bytecode_cache = self.cache
+        self.orig_setup_bytecode_cache = plat._setup_bytecode_cache
+        plat._setup_bytecode_cache = lambda: None
+        self.orig_no_bytecode_cache = os.environ.pop("AMARANTH_NO_BYTECODE_CACHE", None)
+        self.orig_template_cache = TemplatedPlatform._template_cache
+
+    def tearDown(self):
+        TemplatedPlatform._template_cache = self.orig_template_cache
+        if self.orig_no_bytecode_cache is not None:
+            os.environ["AMARANTH_NO_BYTECODE_CACHE"] = self.orig_no_bytecode_cache
+        else:
+            os.environ.pop("AMARANTH_NO_BYTECODE_CACHE", None)
+        plat._setup_bytecode_cache = self.orig_setup_bytecode_cache
+        plat._JINJA_ENV.bytecode_cache = self.orig_bytecode_cache
+        self.cache_dir.cleanup()
+
+    def prepare(self):
+        # Make sure templates are compiled (or loaded from the cache) rather than reused.
+        TemplatedPlatform._template_cache = {}
+        return MockTemplatedPlatform().prepare(Module(), name="top")
+
+    def cache_files(self):
+        return sorted(os.listdir(self.cache_dir.name))
+
+    def test_hit(self):
+        plan = self.prepare()
+        self.assertNotEqual(self.cache_files(), [])
+        compiled = []
+        orig_compile = plat._JINJA_ENV.compile
+        def compile(*args, **kwargs):
+            compiled.append(args)
+            return orig_compile(*args, **kwargs)
+        plat._JINJA_ENV.compile = compile
+        try:
+            self.assertEqual(self.prepare().files, plan.files)
+        finally:
+            del plat._JINJA_ENV.compile
+        self.assertEqual(compiled, [])
+
+    def test_corrupt(self):
+        plan = self.prepare()
+        files = self.cache_files()
+        # Keep the header intact, so that the truncation is only noticed while unpickling.
+        size = len(jinja2.bccache.bc_magic) + 4
+        for filename in files:
+            with open(os.path.join(self.cache_dir.name, filename), "r+b") as f:
+                f.truncate(size)
+        self.assertEqual(self.prepare().files, plan.files)
+        self.assertEqual(self.cache_files(), files)
+        for filename in files:
+            self.assertGreater(os.path.getsize(os.path.join(self.cache_dir.name, filename)), size)
+
+    def test_disabled(self):
+        os.environ["AMARANTH_NO_BYTECODE_CACHE"] = "1"
+        self.prepare()
+        self.assertEqual(self.cache_files(), [])
+
+    def test_enabled(self):
+        os.environ["AMARANTH_NO_BYTECODE_CACHE"] = "0"
+        self.prepare()
+        self.assertNotEqual(self.cache_files(), [])
+
+    def test_wrong_flag(self):
+        os.environ["AMARANTH_NO_BYTECODE_CACHE"] = "maybe"
+        with self.assertRaisesRegex(ValueError,
+                r"^Override 'NO_BYTECODE_CACHE' must be one of \(\"0\", \"n\", \"no\", "
+                r"\"false\", \"\"\) or \(\"1\", \"y\", \"yes\", \"true\"\), not 'maybe'$"):
+            self.prepare()
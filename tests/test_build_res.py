@@ -216,6 +216,19 @@ class ResourceManagerTestCase(FHDLTestCase):
             (clk50.i, clk50_port, 50e6)
         ])
 
+    def test_iter_clock_constraints_incremental(self):
+        clk100 = self.cm.request("clk100", 0)
+        clk100_port_p, clk100_port_n = self.cm.iter_ports()
+        self.assertEqual(list(self.cm.iter_clock_constraints()), [
+            (clk100.i, clk100_port_p, 100e6),
+        ])
+        clk50 = self.cm.request("clk50", 0, dir="i")
+        clk100_port_p, clk100_port_n, clk50_port = self.cm.iter_ports()
+        self.assertEqual(list(self.cm.iter_clock_constraints()), [
+            (clk100.i, clk100_port_p, 100e6),
+            (clk50.i, clk50_port, 50e6)
+        ])
+
     def test_add_clock(self):
         i2c = self.cm.request("i2c")
         self.cm.add_clock_constraint(i2c.scl.o, 100e3)